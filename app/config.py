@@ -25,6 +25,8 @@ class Settings(BaseSettings):
     openai_api_key: str
     openai_model: str = "gpt-4o"
     openai_mini_model: str = "gpt-4o-mini"
+    embed_rpm: int = 3000  # Embedding requests per minute for bulk sync (EMBED_RPM)
+    openai_concurrency: int = 8  # Parallel embedding requests per batch call
     
     # Autotask Configuration
     autotask_username: str
@@ -1,6 +1,7 @@
 """
 Main FastAPI Application
 """
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -86,6 +87,14 @@ async def startup_event():
         print("[OK] Database connection verified")
     else:
         print("[ERROR] WARNING: Database connection failed")
+    
+    # Load the embedding tokenizer now (it may be downloaded) rather than on
+    # the first long text inside a request
+    from app.services.embedding_service import load_encoding
+    if await asyncio.to_thread(load_encoding):
+        print("[OK] Embedding tokenizer loaded")
+    else:
+        print("[ERROR] WARNING: Embedding tokenizer unavailable, truncating by characters")
 
 
 @app.on_event("shutdown")
@@ -94,3 +103,6 @@ async def shutdown_event():
     print("\n" + "="*60)
     print("Shutting down application...") 
     print("="*60 + "\n")
+
+    from app.services.database import get_database_service
+    get_database_service().close()
@@ -49,10 +49,10 @@ All existing functionality remains intact - these are purely additive enhancemen
 
 import json
 import logging
-import math
 import time
 from typing import List, Dict, Optional, Any
 from enum import IntEnum
+import numpy as np
 from openai import AsyncOpenAI
 from app.config import get_settings
 from app.services.database import get_database_service
@@ -1479,6 +1479,9 @@ Use markdown formatting with headers, numbered lists, and code blocks where appr
                 try:
                     records = self.db_service.client.table(table).select("*").not_.is_("embedding", "null").limit(1000).execute().data or []
                     
+                    # Stack the parsed vectors into one matrix and score them together
+                    candidates = []
+                    vectors = []
                     for record in records:
                         embedding_data = record.get("embedding")
                         if not embedding_data:
@@ -1486,21 +1489,27 @@ Use markdown formatting with headers, numbered lists, and code blocks where appr
                         
                         try:
                             if isinstance(embedding_data, str):
-                                embedding_data = embedding_data.strip('[]')
-                                record_embedding = [float(x.strip()) for x in embedding_data.split(',')]
-                            elif isinstance(embedding_data, list):
-                                record_embedding = embedding_data
-                            else:
+                                # pgvector text form "[0.1,0.2,...]" is a JSON array
+                                embedding_data = json.loads(embedding_data)
+                            elif not isinstance(embedding_data, list):
                                 continue
                             
-                            sim = self._cosine_similarity(query_embedding, record_embedding)
-                            
-                            if sim >= threshold:
-                                record["similarity_score"] = sim
-                                record["source_table"] = table
-                                results.append(record)
+                            if len(embedding_data) != len(query_embedding):
+                                continue
+                            vectors.append(embedding_data)
+                            candidates.append(record)
                         except:
                             continue
+                    
+                    if not vectors:
+                        continue
+                    
+                    matrix = np.array(vectors, dtype=np.float32)
+                    for i, sim in self.embedding_service.top_k_cosine(query_embedding, matrix, limit, threshold):
+                        record = candidates[i]
+                        record["similarity_score"] = sim
+                        record["source_table"] = table
+                        results.append(record)
                 except Exception as e:
                     logger.error(f"Error searching {table}: {e}")
             
@@ -1669,20 +1678,6 @@ Use markdown formatting with headers, numbered lists, and code blocks where appr
                 "tickets": [],
                 "ticket_count": 0
             }
-    
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Compute cosine similarity"""
-        try:
-            if len(vec1) != len(vec2):
-                return 0.0
-            
-            dot = sum(float(a) * float(b) for a, b in zip(vec1, vec2))
-            mag1 = math.sqrt(sum(float(a) * float(a) for a in vec1))
-            mag2 = math.sqrt(sum(float(b) * float(b) for b in vec2))
-            
-            return dot / (mag1 * mag2) if mag1 and mag2 else 0.0
-        except:
-            return 0.0
 
 
 # ==================== QUERY METRICS & METADATA ====================
@@ -691,76 +691,179 @@
 Database Service
 Handles all Supabase database operations
 """
-from typing import List, Dict, Optional
-from supabase import create_client, Client
+import asyncio
+import functools
+import logging
+import operator
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from supabase import create_client, Client, ClientOptions
 from app.config import get_settings
 from app.models.schemas import SyncStats
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Gateway/availability status codes worth retrying (525 = Cloudflare SSL handshake)
+RETRIABLE_STATUS_CODES = {"502", "503", "504", "525"}
+
+
+def is_retriable_error(error: Exception) -> bool:
+    """True for network failures and transient gateway errors"""
+    if isinstance(error, (httpx.TransportError, httpx.TimeoutException)):
+        return True
+    return isinstance(error, APIError) and str(error.code) in RETRIABLE_STATUS_CODES
+
+
+def ttl_cache(seconds: float):
+    """
+    Cache a DatabaseService method's result per arguments for `seconds`.
+
+    Entries live in the instance's _stats_cache, which write paths clear.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            hit = self._stats_cache.get(key)
+            if hit and now - hit[0] < seconds:
+                return hit[1]
+            value = fn(self, *args, **kwargs)
+            self._stats_cache[key] = (now, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def _field_mapper(fields: Tuple[Tuple[str, str, Any], ...]):
+    """
+    Build an Autotask -> database row transform from (db_key, api_key, default)
+    
+    Autotask normally returns every field, so all values are fetched with a
+    single itemgetter call; the per-key .get() path only runs when a field
+    is missing.
+    """
+    db_keys = tuple(db_key for db_key, _, _ in fields)
+    getter = operator.itemgetter(*(api_key for _, api_key, _ in fields))
+
+    def transform(entry: Dict) -> Dict:
+        try:
+            return dict(zip(db_keys, getter(entry)))
+        except KeyError:
+            return {db_key: entry.get(api_key, default) for db_key, api_key, default in fields}
+
+    return transform
+
+
+_ticket_mapper = _field_mapper((
+    ("id", "id", None),
+    ("ticket_number", "ticketNumber", None),
+    ("title", "title", None),
+    ("description", "description", ""),
+    ("status", "status", None),
+    ("priority", "priority", None),
+    ("ticket_type", "ticketType", None),
+    ("ticket_category", "ticketCategory", None),
+    ("create_date", "createDate", None),
+    ("due_date_time", "dueDateTime", None),
+    ("completed_date", "completedDate", None),
+    ("resolved_date_time", "resolvedDateTime", None),
+    ("last_activity_date", "lastActivityDate", None),
+    ("company_id", "companyID", None),
+    ("contact_id", "contactID", None),
+    ("assigned_resource_id", "assignedResourceID", None),
+    ("resolution", "resolution", ""),
+    ("source", "source", None),
+    ("issue_type", "issueType", None),
+    ("sub_issue_type", "subIssueType", None),
+    ("queue_id", "queueID", None),
+))
+
+_note_mapper = _field_mapper((
+    ("id", "id", None),
+    ("ticket_id", "ticketID", None),
+    ("title", "title", ""),
+    ("description", "description", ""),
+    ("note_type", "noteType", None),
+    ("create_date_time", "createDateTime", None),
+))
+
+_time_entry_mapper = _field_mapper((
+    ("id", "id", None),
+    ("ticket_id", "ticketID", None),
+    ("date_worked", "dateWorked", None),
+    ("hours_worked", "hoursWorked", None),
+    ("summary_notes", "summaryNotes", ""),
+    ("resource_id", "resourceID", None),
+))
 
 class DatabaseService:
     """Service for database operations with Supabase"""
+
+    # Ticket search filters: (param, query method, column, skip falsy values).
+    # status/priority only skip None so that 0 is still a usable filter.
+    _FILTER_SPEC = (
+        ("company_id", "eq", "company_id", True),
+        ("status", "eq", "status", False),
+        ("priority", "eq", "priority", False),
+        ("start_date", "gte", "create_date", True),
+        ("end_date", "lte", "create_date", True),
+    )
+
+    # Keys returned by get_database_stats
+    _STATS_TABLES = ("tickets", "notes", "time_entries", "companies", "resources", "contacts")
     
     def __init__(self):
-        self.client: Client = create_client(settings.supabase_url, settings.supabase_key)
+        # One pooled HTTP/2 connection set shared by every query, so TLS and
+        # TCP setup is paid once rather than per request
+        self._http = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=30
+        )
+        self.client: Client = create_client(
+            settings.supabase_url,
+            settings.supabase_key,
+            options=ClientOptions(httpx_client=self._http)
+        )
+        self._stats_cache: Dict[Tuple, Tuple[float, Any]] = {}
+    
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
     
     @staticmethod
     def transform_ticket(ticket: Dict) -> Dict:
         """Transform Autotask ticket to database schema"""
+        row = _ticket_mapper(ticket)
+
         # Handle sub_issue_type - set to None if not provided or if it might be invalid
         # This prevents foreign key constraint violations
-        sub_issue_type = ticket.get("subIssueType")
-        if sub_issue_type == 0 or sub_issue_type == "":
-            sub_issue_type = None
+        if row["sub_issue_type"] == 0 or row["sub_issue_type"] == "":
+            row["sub_issue_type"] = None
 
-        return {
-            "id": ticket.get("id"),
-            "ticket_number": ticket.get("ticketNumber"),
-            "title": ticket.get("title"),
-            "description": ticket.get("description", ""),
-            "status": ticket.get("status"),
-            "priority": ticket.get("priority"),
-            "ticket_type": ticket.get("ticketType"),
-            "ticket_category": ticket.get("ticketCategory"),
-            "create_date": ticket.get("createDate"),
-            "due_date_time": ticket.get("dueDateTime"),
-            "completed_date": ticket.get("completedDate"),
-            "resolved_date_time": ticket.get("resolvedDateTime"),
-            "last_activity_date": ticket.get("lastActivityDate"),
-            "company_id": ticket.get("companyID"),
-            "contact_id": ticket.get("contactID"),
-            "assigned_resource_id": ticket.get("assignedResourceID"),
-            "resolution": ticket.get("resolution", ""),
-            "source": ticket.get("source"),
-            "issue_type": ticket.get("issueType"),
-            "sub_issue_type": sub_issue_type,  # Now handles None gracefully
-            "queue_id": ticket.get("queueID"),
-        }
+        return row
     
     @staticmethod
     def transform_note(note: Dict) -> Dict:
         """Transform Autotask note to database schema"""
-        return {
-            "id": note.get("id"),
-            "ticket_id": note.get("ticketID"),
-            "title": note.get("title", ""),
-            "description": note.get("description", ""),
-            "note_type": note.get("noteType"),
-            "create_date_time": note.get("createDateTime"),
-        }
+        return _note_mapper(note)
     
     @staticmethod
     def transform_time_entry(entry: Dict) -> Dict:
         """Transform Autotask time entry to database schema"""
-        return {
-            "id": entry.get("id"),
-            "ticket_id": entry.get("ticketID"),
-            "date_worked": entry.get("dateWorked"),
-            "hours_worked": entry.get("hoursWorked"),
-            "summary_notes": entry.get("summaryNotes", ""),
-            "resource_id": entry.get("resourceID"),
-        }
+        return _time_entry_mapper(entry)
     
     async def store_tickets_with_details(self, tickets_data: List[Dict]) -> SyncStats:
         """
@@ -773,8 +876,10 @@ class DatabaseService:
             SyncStats with operation statistics
         """
         stats = SyncStats()
+        total = len(tickets_data)
+        debug = logger.isEnabledFor(logging.DEBUG)
 
-        print(f"\nStoring {len(tickets_data)} tickets in database...")
+        logger.info("Storing %d tickets in database...", total)
 
         for idx, ticket_data in enumerate(tickets_data, 1):
             ticket_id = ticket_data.get("id", "unknown")
@@ -790,29 +895,28 @@ class DatabaseService:
 
                 while retry_count < max_retries and not ticket_stored:
                     try:
-                        result = self.client.table("tickets").upsert(ticket, on_conflict="id").execute()
+                        # return=minimal: only the count comes back, not the row
+                        result = self.client.table("tickets").upsert(
+                            ticket, on_conflict="id", returning=ReturnMethod.minimal, count="exact"
+                        ).execute()
                         stats.tickets_processed += 1
-                        if result.data:
-                            stats.tickets_inserted += 1
-                            print(f"  ✓ Stored ticket {ticket_id} ({idx}/{len(tickets_data)})")
-                            ticket_stored = True
+                        stats.tickets_inserted += result.count or 1
+                        if debug:
+                            logger.debug("Stored ticket %s (%d/%d)", ticket_id, idx, total)
+                        ticket_stored = True
                     except Exception as e:
                         retry_count += 1
-                        error_str = str(e)
-
-                        # Check if it's a network/SSL error that might succeed on retry
-                        is_retriable = any(keyword in error_str.lower() for keyword in
-                                         ['ssl', 'handshake', 'timeout', 'connection', '525', '503', '502'])
 
-                        if is_retriable and retry_count < max_retries:
-                            print(f"  ⚠ Ticket {ticket_id}: Network error, retrying ({retry_count}/{max_retries})...")
-                            import asyncio
-                            await asyncio.sleep(2 ** retry_count)  # Exponential backoff: 2s, 4s, 8s
+                        if is_retriable_error(e) and retry_count < max_retries:
+                            logger.warning("Ticket %s: network error, retrying (%d/%d)...",
+                                           ticket_id, retry_count, max_retries)
+                            # Exponential backoff with full jitter so parallel syncs don't retry in lockstep
+                            await asyncio.sleep(random.uniform(0, min(30, 2 ** retry_count)))
                         else:
                             # Not retriable or max retries reached
-                            error_msg = f"Ticket {ticket_id}: {error_str}"
+                            error_msg = f"Ticket {ticket_id}: {str(e)}"
                             stats.errors.append(error_msg)
-                            print(f"  ✗ {error_msg}")
+                            logger.error(error_msg)
                             break
                 
                 # Store notes
@@ -821,15 +925,17 @@ class DatabaseService:
                     try:
                         transformed_notes = [self.transform_note(n) for n in notes]
                         notes_result = self.client.table("ticket_notes").upsert(
-                            transformed_notes, on_conflict="id"
+                            transformed_notes, on_conflict="id",
+                            returning=ReturnMethod.minimal, count="exact"
                         ).execute()
-                        if notes_result.data:
-                            stats.notes_inserted += len(notes_result.data)
-                            print(f"    → Stored {len(notes_result.data)} notes")
+                        notes_stored = notes_result.count or len(transformed_notes)
+                        stats.notes_inserted += notes_stored
+                        if debug:
+                            logger.debug("Stored %d notes for ticket %s", notes_stored, ticket_id)
                     except Exception as e:
                         error_msg = f"Notes for ticket {ticket_id}: {str(e)}"
                         stats.errors.append(error_msg)
-                        print(f"    ⚠ {error_msg}")
+                        logger.warning(error_msg)
                 
                 # Store time entries
                 time_entries = ticket_data.get("time_entries", [])
@@ -837,32 +943,46 @@ class DatabaseService:
                     try:
                         transformed_entries = [self.transform_time_entry(e) for e in time_entries]
                         entries_result = self.client.table("time_entries").upsert(
-                            transformed_entries, on_conflict="id"
+                            transformed_entries, on_conflict="id",
+                            returning=ReturnMethod.minimal, count="exact"
                         ).execute()
-                        if entries_result.data:
-                            stats.time_entries_inserted += len(entries_result.data)
-                            print(f"    → Stored {len(entries_result.data)} time entries")
+                        entries_stored = entries_result.count or len(transformed_entries)
+                        stats.time_entries_inserted += entries_stored
+                        if debug:
+                            logger.debug("Stored %d time entries for ticket %s", entries_stored, ticket_id)
                     except Exception as e:
                         error_msg = f"Time entries for ticket {ticket_id}: {str(e)}"
                         stats.errors.append(error_msg)
-                        print(f"    ⚠ {error_msg}")
+                        logger.warning(error_msg)
                     
             except Exception as e:
                 error_msg = f"Processing ticket {ticket_id}: {str(e)}"
                 stats.errors.append(error_msg)
-                print(f"  ✗ {error_msg}")
-        
-        print(f"\n{'='*60}")
-        print(f"Storage Complete!")
-        print(f"{'='*60}")
-        print(f"Tickets: {stats.tickets_inserted}/{stats.tickets_processed}")
-        print(f"Notes: {stats.notes_inserted}")
-        print(f"Time entries: {stats.time_entries_inserted}")
-        print(f"Errors: {len(stats.errors)}")
-        print(f"{'='*60}\n")
+                logger.error(error_msg)
+
+            if idx % 100 == 0:
+                logger.info("Stored %d/%d tickets", idx, total)
+        
+        logger.info(
+            "Storage complete: tickets %d/%d, notes %d, time entries %d, errors %d",
+            stats.tickets_inserted, stats.tickets_processed, stats.notes_inserted,
+            stats.time_entries_inserted, len(stats.errors)
+        )
+
+        # Counts changed, drop cached stats
+        self._stats_cache.clear()
         
         return stats
 
+    def _apply_filters(self, query, params: Dict):
+        """Apply the ticket search filters in _FILTER_SPEC to a query"""
+        for key, op, column, skip_falsy in self._FILTER_SPEC:
+            value = params.get(key)
+            if value is None or (skip_falsy and not value):
+                continue
+            query = getattr(query, op)(column, value)
+        return query
+
     def search_tickets(self, params: Dict) -> List[Dict]:
         """
         Search tickets with filters
@@ -873,22 +993,7 @@ class DatabaseService:
         Returns:
             List of matching tickets
         """
-        query = self.client.table("tickets").select("*")
-        
-        if "company_id" in params and params["company_id"]:
-            query = query.eq("company_id", params["company_id"])
-        
-        if "status" in params and params["status"] is not None:
-            query = query.eq("status", params["status"])
-        
-        if "priority" in params and params["priority"] is not None:
-            query = query.eq("priority", params["priority"])
-        
-        if "start_date" in params and params["start_date"]:
-            query = query.gte("create_date", params["start_date"])
-        
-        if "end_date" in params and params["end_date"]:
-            query = query.lte("create_date", params["end_date"])
+        query = self._apply_filters(self.client.table("tickets").select("*"), params)
         
         # Handle pagination
         limit = params.get("limit", settings.default_search_limit)
@@ -911,22 +1016,7 @@ class DatabaseService:
         Returns:
             Count of matching tickets
         """
-        query = self.client.table("tickets").select("id", count="exact")
-        
-        if "company_id" in params and params["company_id"]:
-            query = query.eq("company_id", params["company_id"])
-        
-        if "status" in params and params["status"] is not None:
-            query = query.eq("status", params["status"])
-        
-        if "priority" in params and params["priority"] is not None:
-            query = query.eq("priority", params["priority"])
-        
-        if "start_date" in params and params["start_date"]:
-            query = query.gte("create_date", params["start_date"])
-        
-        if "end_date" in params and params["end_date"]:
-            query = query.lte("create_date", params["end_date"])
+        query = self._apply_filters(self.client.table("tickets").select("id", count="exact"), params)
         
         # Only get count, no data
         result = query.limit(1).execute()
@@ -936,38 +1026,34 @@ class DatabaseService:
         self, 
         params: Dict, 
         batch_size: int = 1000, 
-        offset: int = 0
-    ) -> tuple[List[Dict], bool]:
+        offset: int = 0,
+        after_id: Optional[int] = None
+    ) -> tuple[List[Dict], bool, Optional[int]]:
         """
-        Get a batch of tickets with pagination
+        Get a batch of tickets with pagination, ordered by id
+        
+        Callers walking through all matching tickets should pass the returned
+        next_after_id back as after_id (keyset pagination) rather than
+        advancing offset: deep OFFSETs make Postgres scan and discard every
+        earlier row on each call.
         
         Args:
             params: Search parameters
             batch_size: Number of tickets per batch
-            offset: Starting offset
+            offset: Starting offset (ignored when after_id is given)
+            after_id: Only return tickets with an id greater than this
             
         Returns:
-            Tuple of (tickets, has_more)
+            Tuple of (tickets, has_more, next_after_id)
         """
-        query = self.client.table("tickets").select("*")
-        
-        if "company_id" in params and params["company_id"]:
-            query = query.eq("company_id", params["company_id"])
-        
-        if "status" in params and params["status"] is not None:
-            query = query.eq("status", params["status"])
-        
-        if "priority" in params and params["priority"] is not None:
-            query = query.eq("priority", params["priority"])
-        
-        if "start_date" in params and params["start_date"]:
-            query = query.gte("create_date", params["start_date"])
-        
-        if "end_date" in params and params["end_date"]:
-            query = query.lte("create_date", params["end_date"])
+        query = self._apply_filters(self.client.table("tickets").select("*"), params)
+        query = query.order("id")
         
         # Fetch one extra to check if there are more
-        query = query.range(offset, offset + batch_size)
+        if after_id is not None:
+            query = query.gt("id", after_id).limit(batch_size + 1)
+        else:
+            query = query.range(offset, offset + batch_size)
         result = query.execute()
         
         tickets = result.data
@@ -976,8 +1062,10 @@ class DatabaseService:
         if has_more:
             tickets = tickets[:batch_size]
         
-        return tickets, has_more
+        next_after_id = tickets[-1]["id"] if has_more else None
+        return tickets, has_more, next_after_id
     
+    @ttl_cache(30)
     def get_database_stats(self) -> Dict[str, int]:
         """
         Get database statistics
@@ -985,6 +1073,13 @@ class DatabaseService:
         Returns:
             Dictionary with counts of tickets, notes, time entries, companies, resources, and contacts
         """
+        # All six counts in one round trip (see migrations/001_db_counts.sql)
+        try:
+            counts = self.client.rpc("db_counts").execute().data or {}
+            return {key: counts.get(key) or 0 for key in self._STATS_TABLES}
+        except Exception as e:
+            logger.warning(f"db_counts RPC unavailable, counting tables individually: {e}")
+
         tickets = self.client.table("tickets").select("id", count="exact").limit(1).execute()
         notes = self.client.table("ticket_notes").select("id", count="exact").limit(1).execute()
         entries = self.client.table("time_entries").select("id", count="exact").limit(1).execute()
@@ -1001,6 +1096,7 @@ class DatabaseService:
             "contacts": contacts.count or 0
         }
     
+    @ttl_cache(30)
     def get_ticket_stats_by_status(self) -> List[Dict]:
         """
         Get ticket counts grouped by status
@@ -1008,18 +1104,14 @@ class DatabaseService:
         Returns:
             List of status statistics
         """
-        result = self.client.table("tickets")\
-            .select("status")\
+        # Grouped server side (see migrations/002_ticket_stat_views.sql)
+        result = self.client.table("ticket_status_counts")\
+            .select("*")\
             .execute()
         
-        # Aggregate in Python
-        stats = {}
-        for ticket in result.data:
-            status = ticket.get("status", "Unknown")
-            stats[status] = stats.get(status, 0) + 1
-        
-        return [{"status": k, "count": v} for k, v in stats.items()]
+        return result.data or []
     
+    @ttl_cache(30)
     def get_ticket_stats_by_priority(self) -> List[Dict]:
         """
         Get ticket counts grouped by priority
@@ -1027,17 +1119,12 @@ class DatabaseService:
         Returns:
             List of priority statistics
         """
-        result = self.client.table("tickets")\
-            .select("priority")\
+        # Grouped server side (see migrations/002_ticket_stat_views.sql)
+        result = self.client.table("ticket_priority_counts")\
+            .select("*")\
             .execute()
         
-        # Aggregate in Python
-        stats = {}
-        for ticket in result.data:
-            priority = ticket.get("priority", "Unknown")
-            stats[priority] = stats.get(priority, 0) + 1
-        
-        return [{"priority": k, "count": v} for k, v in stats.items()]
+        return result.data or []
     
     def health_check(self) -> bool:
         """
@@ -1074,6 +1161,7 @@ class DatabaseService:
             return 0
         try:
             result = self.client.table(table_name).upsert(data, on_conflict="id").execute()
+            self._stats_cache.clear()
             return len(result.data) if result.data else 0
         except Exception as e:
             print(f"Error syncing {table_name}: {str(e)}")
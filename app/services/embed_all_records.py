@@ -10,19 +10,24 @@ Options:
     --batch-size: Batch size for processing (default: 100)
     --force: Re-embed even if already embedded
     --dry-run: Show what would be done without doing it
+    --estimate-cost: Count pending records and log the estimated cost first
+                     (tables over the Batch API threshold then use it automatically)
+    --batch-api: Embed through the OpenAI Batch API (50% cheaper, async)
 """
 import asyncio
 import sys
 import argparse
-from datetime import datetime
-from typing import List, Dict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
 import logging
+from aiolimiter import AsyncLimiter
 
 # Add parent directory to path
 sys.path.insert(0, '.')
 
+from app.config import get_settings
 from app.services.database import get_database_service
-from app.services.embedding_service import get_embedding_service
+from app.services.embedding_service import get_embedding_service, load_encoding
 
 logging.basicConfig(
     level=logging.INFO,
@@ -34,12 +39,24 @@ logger = logging.getLogger(__name__)
 class EmbeddingSyncManager:
     """Manages the embedding sync process"""
     
-    def __init__(self, batch_size: int = 100, force: bool = False, dry_run: bool = False):
+    def __init__(
+        self,
+        batch_size: int = 100,
+        force: bool = False,
+        dry_run: bool = False,
+        estimate: bool = False,
+        requests_per_minute: Optional[int] = None,
+        use_batch_api: bool = False
+    ):
         self.db = get_database_service()
         self.embedding_service = get_embedding_service()
         self.batch_size = batch_size
         self.force = force
         self.dry_run = dry_run
+        self.estimate = estimate
+        self.use_batch_api = use_batch_api
+        # Paces embedding API requests without idling the fetch/write stages
+        self.rate_limiter = AsyncLimiter(requests_per_minute or get_settings().embed_rpm, 60)
         
         self.stats = {
             "total_processed": 0,
@@ -49,6 +66,69 @@ class EmbeddingSyncManager:
             "by_table": {}
         }
     
+    async def _embed(
+        self,
+        texts: List[str],
+        offline: bool = False
+    ) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings, taking one rate limiter token per API request
+        (the service retries 429s)
+        
+        Args:
+            texts: Texts to embed
+            offline: Use the Batch API instead of the live endpoint
+            
+        Returns:
+            List of embeddings (None where a Batch API request failed)
+        """
+        if offline:
+            return await self.embedding_service.generate_embeddings_batch_offline(texts)
+        
+        return await self.embedding_service.generate_embeddings_batch(
+            texts, rate_limiter=self.rate_limiter
+        )
+    
+    async def _iter_batches(self, table: str) -> AsyncIterator[List[Dict]]:
+        """
+        Lazily yield batches of records that need embedding
+        
+        Uses keyset pagination on id, fetching one extra row each time to
+        know if more remain. Unlike OFFSET this neither rescans earlier rows
+        nor skips rows when written batches drop out of the IS NULL filter.
+        Only one batch is held at a time, so peak memory is bounded by the
+        pipeline queues rather than the table size.
+        
+        Args:
+            table: Table name
+            
+        Yields:
+            Lists of at most batch_size records
+        """
+        last_id = None
+        has_more = True
+        while has_more:
+            logger.info(f"Fetching batch after id {last_id}")
+            
+            query = self.db.client.table(table).select("*")
+            if not self.force:
+                query = query.is_("embedding", "null")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            query = self.embedding_service.apply_content_filter(table, query)
+            
+            batch_result = await asyncio.to_thread(
+                query.order("id").limit(self.batch_size + 1).execute
+            )
+            has_more = len(batch_result.data) > self.batch_size
+            records = batch_result.data[:self.batch_size]
+            
+            if not records:
+                return
+            
+            last_id = records[-1]["id"]
+            yield records
+    
     async def sync_table(self, table: str) -> Dict:
         """
         Sync embeddings for a specific table
@@ -66,110 +146,186 @@ class EmbeddingSyncManager:
             return {"processed": 0, "embedded": 0, "skipped": 0, "errors": 0}
         
         stats = {"processed": 0, "embedded": 0, "skipped": 0, "errors": 0}
+        use_batch_api = self.use_batch_api
         
-        # Get total count
-        count_query = self.db.client.table(table).select("id", count="exact")
-        if not self.force:
-            # Only get records without embeddings
-            count_query = count_query.is_("embedding", "null")
-        
-        total_result = count_query.execute()
-        total_records = total_result.count or 0
-        
-        logger.info(f"Found {total_records:,} records to process in {table}")
-        
-        if total_records == 0:
-            logger.info(f"No records to process in {table}")
-            return stats
-        
-        # Estimate cost
-        cost_info = await self.embedding_service.estimate_cost(total_records)
-        logger.info(f"Estimated cost: ${cost_info['estimated_cost_usd']} "
-                   f"({cost_info['estimated_tokens']:,} tokens)")
-        
-        if self.dry_run:
-            logger.info(f"[DRY RUN] Would process {total_records:,} records")
-            return {"processed": total_records, "embedded": 0, "skipped": 0, "errors": 0}
-        
-        # Process in batches
-        offset = 0
-        while offset < total_records:
-            logger.info(f"Processing batch {offset // self.batch_size + 1} "
-                       f"({offset:,} - {min(offset + self.batch_size, total_records):,} "
-                       f"of {total_records:,})")
-            
+        # Counting forces a full scan of the table, so only do it when asked
+        if self.estimate or self.dry_run:
+            count_query = self.db.client.table(table).select("id", count="exact")
+            if not self.force:
+                # Only get records without embeddings
+                count_query = count_query.is_("embedding", "null")
+            # Same content filter as _iter_batches, so the estimate matches the run
+            count_query = self.embedding_service.apply_content_filter(table, count_query)
+
+            total_result = count_query.limit(1).execute()
+            total_records = total_result.count or 0
+
+            logger.info(f"Found {total_records:,} records to process in {table}")
+
+            cost_info = await self.embedding_service.estimate_cost(total_records)
+            logger.info(f"Estimated cost: ${cost_info['estimated_cost_usd']} real-time, "
+                       f"${cost_info['estimated_batch_cost_usd']} via Batch API "
+                       f"({cost_info['estimated_tokens']:,} tokens)")
+            if cost_info["use_batch_api"] and not self.dry_run:
+                logger.info(f"{total_records:,} records: using the Batch API for {table}")
+                use_batch_api = True
+
+            if self.dry_run:
+                logger.info(f"[DRY RUN] Would process {total_records:,} records")
+                return {"processed": total_records, "embedded": 0, "skipped": 0, "errors": 0}
+
+        # Fetch, embed and write run as a pipeline so batch N+1 is fetched while
+        # batch N is being embedded and batch N-1 is being written.
+        fetch_q: asyncio.Queue = asyncio.Queue(maxsize=2)
+        write_q: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+        async def fetcher():
+            """Feed lazily fetched batches into the pipeline"""
+            batch_no = 0
             try:
-                # Fetch batch
-                query = self.db.client.table(table).select("*")
-                if not self.force:
-                    query = query.is_("embedding", "null")
-                
-                batch_result = query.range(offset, offset + self.batch_size - 1).execute()
-                records = batch_result.data
-                
-                if not records:
-                    break
-                
-                # Prepare texts
-                texts = []
-                valid_records = []
-                for record in records:
-                    text = self.embedding_service.prepare_text_for_embedding(table, record)
-                    if text and len(text.strip()) > 5:  # Only embed if has meaningful content
-                        texts.append(text)
-                        valid_records.append(record)
-                    else:
-                        stats["skipped"] += 1
-                        logger.debug(f"Skipping record {record.get('id')} - insufficient content")
-                
-                if not texts:
-                    logger.warning(f"No valid texts in batch at offset {offset}")
-                    offset += self.batch_size
-                    continue
-                
+                async for records in self._iter_batches(table):
+                    batch_no += 1
+                    await fetch_q.put((batch_no, records))
+                if batch_no == 0:
+                    logger.info(f"No records to process in {table}")
+            except Exception as e:
+                logger.error(f"Error fetching batch {batch_no + 1}: {e}")
+                stats["errors"] += self.batch_size
+            finally:
+                await fetch_q.put(None)
+
+        async def embedder():
+            """
+            Prepare texts and generate embeddings for each fetched batch.
+            With the Batch API, fetched batches are pooled into jobs of
+            OFFLINE_BATCH_THRESHOLD texts, and up to OFFLINE_MAX_JOBS jobs run
+            in the background so pooling continues while earlier jobs complete.
+            """
+            job_size = self.embedding_service.OFFLINE_BATCH_THRESHOLD if use_batch_api else 1
+            # Only (id, text) pairs are pooled; the writer needs nothing else
+            pending_ids = []
+            pending_texts = []
+            batch_no = 0
+            jobs = set()
+            job_slots = asyncio.Semaphore(self.embedding_service.OFFLINE_MAX_JOBS)
+
+            async def embed_job(job_no, ids, texts):
                 # Generate embeddings
                 logger.info(f"Generating {len(texts)} embeddings...")
-                embeddings = await self.embedding_service.generate_embeddings_batch(texts)
-                
-                # Update records
-                logger.info(f"Updating {len(valid_records)} records...")
-                for record, embedding, text in zip(valid_records, embeddings, texts):
-                    try:
-                        update_data = {
-                            "embedding": embedding,
-                            "embedding_text": text[:1000],  # Store first 1000 chars for debugging
-                            "last_embedded_at": datetime.utcnow().isoformat()
-                        }
-                        
-                        self.db.client.table(table)\
-                            .update(update_data)\
-                            .eq("id", record["id"])\
-                            .execute()
-                        
-                        stats["embedded"] += 1
-                        
-                    except Exception as e:
-                        logger.error(f"Error updating record {record.get('id')}: {e}")
-                        stats["errors"] += 1
-                
-                stats["processed"] += len(records)
-                
+                try:
+                    embeddings = await self._embed(texts, offline=use_batch_api)
+                except Exception as e:
+                    logger.error(f"Error embedding batch {job_no}: {e}")
+                    stats["errors"] += len(ids)
+                    return
+
+                await write_q.put((job_no, ids, embeddings, texts))
+
+            def job_done(task):
+                jobs.discard(task)
+                job_slots.release()
+
+            async def flush():
+                if not pending_texts:
+                    return
+                ids, texts = pending_ids[:], pending_texts[:]
+                pending_ids.clear()
+                pending_texts.clear()
+
+                if not use_batch_api:
+                    await embed_job(batch_no, ids, texts)
+                    return
+
+                # Wait for a free slot, then submit without waiting for the job
+                await job_slots.acquire()
+                task = asyncio.create_task(embed_job(batch_no, ids, texts))
+                jobs.add(task)
+                task.add_done_callback(job_done)
+
+            try:
+                while True:
+                    item = await fetch_q.get()
+                    if item is None:
+                        break
+                    batch_no, records = item
+                    stats["processed"] += len(records)
+
+                    # Prepare texts
+                    valid_count = 0
+                    texts = self.embedding_service.prepare_texts_for_embedding(table, records)
+                    for record, text in zip(records, texts):
+                        if text and len(text.strip()) > 5:  # Only embed if has meaningful content
+                            pending_texts.append(text)
+                            pending_ids.append(record["id"])
+                            valid_count += 1
+                        else:
+                            stats["skipped"] += 1
+                            logger.debug(f"Skipping record {record.get('id')} - insufficient content")
+
+                    if not valid_count:
+                        logger.warning(f"No valid texts in batch {batch_no}")
+                        continue
+
+                    if len(pending_texts) >= job_size:
+                        await flush()
+                await flush()
+                if jobs:
+                    await asyncio.gather(*jobs)
+            finally:
+                # On failure, jobs still running would write after the sentinel
+                for task in list(jobs):
+                    task.cancel()
+                await write_q.put(None)
+
+        async def writer():
+            """Write each embedded batch back in one bulk update"""
+            while True:
+                item = await write_q.get()
+                if item is None:
+                    break
+                batch_no, ids, embeddings, texts = item
+
+                # Rows the Batch API failed on stay unembedded for the next run
+                failed = sum(1 for embedding in embeddings if embedding is None)
+                if failed:
+                    logger.error(f"{failed} embeddings failed in batch {batch_no}")
+                    stats["errors"] += failed
+
+                # Only the embedding columns are sent, so other columns synced
+                # since the batch was fetched are left alone
+                logger.info(f"Updating {len(ids)} records...")
+                now_iso = datetime.now(timezone.utc).isoformat()
+                updates = [
+                    {
+                        "id": record_id,
+                        "embedding": embedding,
+                        # Store first 1000 chars for debugging
+                        "embedding_text": text if len(text) <= 1000 else text[:1000],
+                        "last_embedded_at": now_iso
+                    }
+                    for record_id, embedding, text in zip(ids, embeddings, texts)
+                    if embedding is not None
+                ]
+
+                try:
+                    # See migrations/010_bulk_update_embeddings.sql
+                    result = await asyncio.to_thread(
+                        self.db.client.rpc("bulk_update_embeddings", {
+                            "table_name": table,
+                            "rows": updates
+                        }).execute
+                    )
+                    stats["embedded"] += result.data or 0
+                except Exception as e:
+                    logger.error(f"Error updating batch {batch_no}: {e}")
+                    stats["errors"] += len(updates)
+
                 # Progress update
-                progress_pct = (offset + len(records)) / total_records * 100
-                logger.info(f"Progress: {progress_pct:.1f}% ({stats['embedded']} embedded, "
+                logger.info(f"Progress: {stats['processed']:,} processed ({stats['embedded']} embedded, "
                            f"{stats['skipped']} skipped, {stats['errors']} errors)")
-                
-                offset += self.batch_size
-                
-                # Small delay to avoid rate limits
-                await asyncio.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"Error processing batch at offset {offset}: {e}")
-                stats["errors"] += self.batch_size
-                offset += self.batch_size
-                continue
-        
+
+        await asyncio.gather(fetcher(), embedder(), writer())
+
         logger.info(f"Completed {table}: {stats['embedded']} embedded, "
                    f"{stats['skipped']} skipped, {stats['errors']} errors")
         
@@ -230,13 +386,22 @@ async def main():
     parser.add_argument("--batch-size", type=int, default=100, help="Batch size")
     parser.add_argument("--force", action="store_true", help="Re-embed existing records")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be done")
+    parser.add_argument("--estimate-cost", action="store_true",
+                        help="Count pending records and estimate cost before syncing")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Embed through the OpenAI Batch API (50%% cheaper, async)")
     
     args = parser.parse_args()
     
+    # Load (and if needed download) the tokenizer before the pipeline starts
+    await asyncio.to_thread(load_encoding)
+    
     manager = EmbeddingSyncManager(
         batch_size=args.batch_size,
         force=args.force,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        estimate=args.estimate_cost,
+        use_batch_api=args.batch_api
     )
     
     try:
@@ -2,26 +2,155 @@
 Embedding Service
 Generates and manages vector embeddings for semantic search
 """
+import asyncio
+import hashlib
+import json
 import logging
-from typing import List, Dict, Optional, Any
-from openai import AsyncOpenAI
+import random
+import re
+import string
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import tiktoken
+from aiolimiter import AsyncLimiter
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, InternalServerError, RateLimitError
 from app.config import get_settings
+from app.services.database import get_database_service
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# One-pass text cleanup: drops "None" placeholders (with the whitespace before
+# them) and collapses every other whitespace run to a single space
+_CLEAN_RE = re.compile(r"(\s*\bNone\b)|\s+")
+
+
+def _clean_text(text: str) -> str:
+    """Strip None placeholders and normalize whitespace"""
+    return _CLEAN_RE.sub(lambda m: "" if m.group(1) else " ", text).strip()
+
+
+
+def _compile_template(template: str) -> Callable[[Dict], str]:
+    """
+    Turn a str.format template of plain {field} placeholders into a function
+    of a row, so the template is parsed once rather than on every row
+    """
+    segments = tuple(
+        (literal, field)
+        for literal, field, _, _ in string.Formatter().parse(template)
+    )
+    
+    def render(row: Dict) -> str:
+        return "".join([
+            literal if field is None else literal + str(row.get(field, "")).strip()
+            for literal, field in segments
+        ])
+    
+    return render
+
+
+# Token limit of the embedding model's input
+MAX_EMBEDDING_TOKENS = 8191
+# Character cut used while the tokenizer is unavailable
+FALLBACK_MAX_CHARS = 32000
+_encoding: Optional[tiktoken.Encoding] = None
+
+
+def load_encoding() -> bool:
+    """
+    Load the embedding model's tokenizer for _truncate_tokens
+    
+    Blocking: tiktoken downloads the BPE file on first use and caches it in
+    TIKTOKEN_CACHE_DIR (default: a tiktoken folder in the system temp dir).
+    Call it once at startup through asyncio.to_thread; for offline hosts,
+    point TIKTOKEN_CACHE_DIR at a directory populated from a networked one.
+    
+    Returns:
+        True if the tokenizer is loaded
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(EmbeddingService.EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning(f"tiktoken encoding unavailable, truncating by characters: {e}")
+            return False
+    return True
+
+
+def _retry_after_seconds(headers, max_wait: float = 60.0) -> Optional[float]:
+    """
+    Parse a Retry-After header given either as seconds or as an HTTP-date
+    
+    Returns:
+        Seconds to wait (capped at max_wait), or None if absent or unparseable
+    """
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        wait = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        wait = (when - datetime.now(timezone.utc)).total_seconds()
+    return min(max(wait, 0.0), max_wait)
+
+
+def _truncate_tokens(text: str, max_tokens: int = MAX_EMBEDDING_TOKENS) -> str:
+    """Cut text to at most max_tokens tokens of the embedding model"""
+    # A token spans at least one UTF-8 byte (at most 4 per char), so short
+    # texts can't be over the limit and skip tokenizing entirely
+    if len(text) * 4 <= max_tokens:
+        return text
+    if _encoding is None:
+        # Never fetch the tokenizer from here: this runs on the event loop
+        return text[:FALLBACK_MAX_CHARS]
+    tokens = _encoding.encode(text, disallowed_special=())
+    return _encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+
 
 class EmbeddingService:
     """Service for generating and managing embeddings"""
     
-    # OpenAI embedding model (1536 dimensions, cheap and fast)
+    # OpenAI embedding model (1536 dimensions, cheap and fast). Every table,
+    # short name strings included, uses this one model: vectors from a
+    # different (e.g. local) model live in another space and can't be
+    # compared against these queries, and short texts are already cheap
+    # here since billing is per token and batching amortizes the round trip.
     EMBEDDING_MODEL = "text-embedding-3-small"
     EMBEDDING_DIMENSIONS = 1536
+    # Stored unquantized in each table's pgvector `embedding` column, which
+    # is the column every search path reads
     
     # Batch size for embedding generation
     BATCH_SIZE = 100
     
-    # Table configuration: what text to embed for each table
+    # Query embedding cache: users repeat the same searches, and an identical
+    # text always maps to the same vector, so hits skip the API round trip
+    CACHE_MAX_ENTRIES = 10_000
+    CACHE_TTL_SECONDS = 24 * 60 * 60
+    
+    # Backfills at least this large should use the Batch API: half the price
+    # of the live endpoint and a separate, much larger rate limit
+    OFFLINE_BATCH_THRESHOLD = 10_000
+    OFFLINE_POLL_SECONDS = 60
+    # Batch API jobs a sync keeps in flight at once; each job can take hours,
+    # so the next one is pooled and submitted while earlier ones run
+    OFFLINE_MAX_JOBS = 4
+    
+    # Table configuration: what text to embed for each table.
+    # "content_filter" is an optional PostgREST or-filter applied when fetching
+    # rows to embed, so rows with nothing to embed never leave the database.
     TABLE_CONFIGS = {
         "tickets": {
             "fields": ["ticket_number", "title", "description", "resolution"],
@@ -33,18 +162,21 @@ class EmbeddingService:
             "fields": ["title", "description"],
             "template": "Note: {title}\n\n{description}",
             "fallback": "{description}",
+            "content_filter": "title.not.is.null,description.not.is.null",
             "enabled": True
         },
         "resources": {
             "fields": ["first_name", "last_name", "title", "user_name"],
             "template": "{first_name} {last_name} - {title} ({user_name})",
             "fallback": "{first_name} {last_name}",
+            "content_filter": "first_name.not.is.null,last_name.not.is.null",
             "enabled": True
         },
         "contacts": {
             "fields": ["first_name", "last_name", "title", "email_address", "note"],
             "template": "{first_name} {last_name} - {title}\nEmail: {email_address}\nNote: {note}",
             "fallback": "{first_name} {last_name}",
+            "content_filter": "first_name.not.is.null,last_name.not.is.null",
             "enabled": True
         },
         "companies": {
@@ -57,19 +189,35 @@ class EmbeddingService:
             "fields": ["summary_notes", "internal_notes"],
             "template": "Summary: {summary_notes}\n\nInternal: {internal_notes}",
             "fallback": "{summary_notes}",
+            "content_filter": "summary_notes.not.is.null,internal_notes.not.is.null",
             "enabled": False  # Disable by default (lots of entries, might not need search)
         }
     }
     
+    # TABLE_CONFIGS is static, so resolve the enabled tables once
+    _ENABLED_TABLES = tuple(t for t, c in TABLE_CONFIGS.items() if c.get("enabled", False))
+    _ENABLED_TABLE_SET = frozenset(_ENABLED_TABLES)
+    
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+        # _create_embeddings owns the retry policy for embedding calls, so the
+        # SDK's own retries are off (they would multiply the attempts and slip
+        # past the rate limiter). The Batch API calls keep the SDK default.
+        self.client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0)
+        self._batch_client = self.client.with_options(max_retries=2)
+        self._text_builders: Dict[str, Callable[[Dict], str]] = {}
+        # sha256(text) -> (cached_at, embedding), least recently used first
+        self._cache: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        # Caps in-flight embedding calls across every caller of this service
+        self._semaphore = asyncio.Semaphore(settings.openai_concurrency)
     
-    async def generate_embedding(self, text: str) -> List[float]:
+    async def generate_embedding(self, text: str, no_cache: bool = False) -> List[float]:
         """
         Generate embedding for a single text
         
         Args:
             text: Text to embed
+            no_cache: Neither read nor store this text in the embedding cache
+                (use for sensitive inputs)
             
         Returns:
             List of floats (vector)
@@ -78,64 +226,209 @@ class EmbeddingService:
             logger.warning("Empty text provided for embedding")
             return [0.0] * self.EMBEDDING_DIMENSIONS
         
+        if not no_cache:
+            key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            hit = self._cache.get(key)
+            if hit and time.monotonic() - hit[0] < self.CACHE_TTL_SECONDS:
+                self._cache.move_to_end(key)
+                return hit[1]
+        
         try:
-            # Truncate if too long (max 8191 tokens for text-embedding-3-small)
-            text = text[:32000]  # Rough approximation
+            text = _truncate_tokens(text)
             
-            response = await self.client.embeddings.create(
-                model=self.EMBEDDING_MODEL,
-                input=text,
-                dimensions=self.EMBEDDING_DIMENSIONS
-            )
+            response = await self._create_embeddings(text)
+            
+            embedding = response.data[0].embedding
+            
+            if not no_cache:
+                self._cache[key] = (time.monotonic(), embedding)
+                self._cache.move_to_end(key)
+                if len(self._cache) > self.CACHE_MAX_ENTRIES:
+                    self._cache.popitem(last=False)
             
-            return response.data[0].embedding
+            return embedding
             
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
     
-    async def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    async def _create_embeddings(
+        self,
+        inputs,
+        max_retries: int = 5,
+        rate_limiter: Optional[AsyncLimiter] = None
+    ):
         """
-        Generate embeddings for multiple texts in one API call
+        Call the embeddings endpoint under the concurrency limit, retrying
+        rate limits, server errors, timeouts and connection errors with
+        jittered exponential backoff (the only retry layer: the client has
+        SDK retries disabled)
+        
+        Args:
+            inputs: A single text or a list of texts
+            max_retries: Attempts before giving up
+            rate_limiter: Optional limiter to take one token from per request
+                (retries included)
+            
+        Returns:
+            The OpenAI embeddings response
+        """
+        for attempt in range(1, max_retries + 1):
+            try:
+                if rate_limiter:
+                    await rate_limiter.acquire()
+                async with self._semaphore:
+                    return await self.client.embeddings.create(
+                        model=self.EMBEDDING_MODEL,
+                        input=inputs,
+                        dimensions=self.EMBEDDING_DIMENSIONS
+                    )
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                if attempt == max_retries:
+                    raise
+                # Prefer the server's hint, otherwise back off with full jitter
+                retry_after = _retry_after_seconds(e.response.headers) if isinstance(e, APIStatusError) else None
+                delay = retry_after if retry_after is not None else random.uniform(0, min(30, 2 ** attempt))
+                logger.warning(f"{type(e).__name__} from OpenAI, retrying in {delay:.1f}s "
+                               f"({attempt}/{max_retries})")
+                await asyncio.sleep(delay)
+    
+    async def generate_embeddings_batch(
+        self,
+        texts: List[str],
+        rate_limiter: Optional[AsyncLimiter] = None
+    ) -> List[List[float]]:
+        """
+        Generate embeddings for multiple texts, sending BATCH_SIZE slices concurrently
         
         Args:
             texts: List of texts to embed
+            rate_limiter: Optional limiter pacing the individual API requests
             
         Returns:
-            List of embeddings
+            List of embeddings as plain lists (they are JSON-encoded for the
+            PostgREST upserts and RPC calls, which take no binary vectors)
         """
         if not texts:
             return []
         
-        # Filter out empty texts but keep track of indices
-        valid_texts = []
-        valid_indices = []
+        # Filter out empty texts and embed each distinct text once (backfills
+        # repeat canned notes and templates), tracking every index it fills
+        positions: Dict[str, List[int]] = {}
         for i, text in enumerate(texts):
             if text and text.strip():
-                valid_texts.append(text[:32000])
-                valid_indices.append(i)
+                positions.setdefault(text, []).append(i)
+        valid_texts = [_truncate_tokens(text) for text in positions]
+        valid_indices = list(positions.values())
+        
+        # One list per row; empty texts keep their zero vector
+        embeddings = [[0.0] * self.EMBEDDING_DIMENSIONS for _ in texts]
         
         if not valid_texts:
             logger.warning("No valid texts to embed")
-            return [[0.0] * self.EMBEDDING_DIMENSIONS] * len(texts)
+            return embeddings
+        
+        async def _embed_chunk(start: int):
+            response = await self._create_embeddings(
+                valid_texts[start:start + self.BATCH_SIZE], rate_limiter=rate_limiter
+            )
+            for embedding_data in response.data:
+                first, *rest = valid_indices[start + embedding_data.index]
+                embeddings[first] = embedding_data.embedding
+                for i in rest:
+                    # Copy so duplicate rows don't share one list
+                    embeddings[i] = embedding_data.embedding[:]
+        
+        try:
+            await asyncio.gather(*[
+                _embed_chunk(start) for start in range(0, len(valid_texts), self.BATCH_SIZE)
+            ])
+            return embeddings
+            
+        except Exception as e:
+            logger.error(f"Error generating batch embeddings: {e}")
+            raise
+    
+    async def generate_embeddings_batch_offline(
+        self,
+        texts: List[str],
+        completion_window: str = "24h"
+    ) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings through the OpenAI Batch API
+        
+        For latency-tolerant backfills only: the job is queued and polled
+        until it finishes, which can take up to `completion_window`.
+        
+        Args:
+            texts: List of texts to embed
+            completion_window: Batch API completion window
+            
+        Returns:
+            List of embeddings; zero vectors for empty texts and None for
+            requests the batch reported as failed
+        """
+        if not texts:
+            return []
+        
+        embeddings: List[Optional[List[float]]] = [
+            [0.0] * self.EMBEDDING_DIMENSIONS for _ in texts
+        ]
+        lines = [
+            json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/embeddings",
+                "body": {
+                    "model": self.EMBEDDING_MODEL,
+                    "input": _truncate_tokens(text),
+                    "dimensions": self.EMBEDDING_DIMENSIONS
+                }
+            })
+            for i, text in enumerate(texts)
+            if text and text.strip()
+        ]
+        
+        if not lines:
+            logger.warning("No valid texts to embed")
+            return embeddings
         
         try:
-            response = await self.client.embeddings.create(
-                model=self.EMBEDDING_MODEL,
-                input=valid_texts,
-                dimensions=self.EMBEDDING_DIMENSIONS
+            input_file = await self._batch_client.files.create(
+                file=("embeddings.jsonl", "\n".join(lines).encode("utf-8")),
+                purpose="batch"
             )
+            batch = await self._batch_client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/embeddings",
+                completion_window=completion_window
+            )
+            logger.info(f"Submitted embedding batch {batch.id} ({len(lines)} texts)")
+            
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                await asyncio.sleep(self.OFFLINE_POLL_SECONDS)
+                batch = await self._batch_client.batches.retrieve(batch.id)
             
-            # Create result list with embeddings in correct positions
-            embeddings = [[0.0] * self.EMBEDDING_DIMENSIONS] * len(texts)
-            for i, embedding_data in enumerate(response.data):
-                original_index = valid_indices[i]
-                embeddings[original_index] = embedding_data.embedding
+            if batch.status != "completed" or not batch.output_file_id:
+                raise RuntimeError(f"Embedding batch {batch.id} ended with status {batch.status}")
+            
+            output = await self._batch_client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                index = int(item["custom_id"])
+                response = item.get("response") or {}
+                if response.get("status_code") != 200:
+                    logger.error(f"Batch request {index} failed: {item.get('error')}")
+                    embeddings[index] = None
+                    continue
+                embeddings[index] = response["body"]["data"][0]["embedding"]
             
             return embeddings
             
         except Exception as e:
-            logger.error(f"Error generating batch embeddings: {e}")
+            logger.error(f"Error generating offline batch embeddings: {e}")
             raise
     
     def prepare_text_for_embedding(self, table: str, row: Dict) -> str:
@@ -149,44 +442,73 @@ class EmbeddingService:
         Returns:
             Formatted text ready for embedding
         """
+        return self.get_text_builder(table)(row)
+    
+    def prepare_texts_for_embedding(self, table: str, rows: List[Dict]) -> List[str]:
+        """
+        Prepare texts for a whole batch of rows from one table
+        
+        Args:
+            table: Table name
+            rows: Database rows as dictionaries
+            
+        Returns:
+            Formatted texts, in the same order as rows
+        """
+        build = self.get_text_builder(table)
+        return [build(row) for row in rows]
+    
+    def get_text_builder(self, table: str) -> Callable[[Dict], str]:
+        """
+        Get the function that formats a row of `table` for embedding
+        
+        The table config is resolved once per table, so callers embedding
+        many rows should fetch the builder once outside their loop.
+        
+        Args:
+            table: Table name
+            
+        Returns:
+            Function taking a row dict and returning the text to embed
+        """
+        builder = self._text_builders.get(table)
+        if builder is None:
+            builder = self._make_text_builder(table)
+            self._text_builders[table] = builder
+        return builder
+    
+    def _make_text_builder(self, table: str) -> Callable[[Dict], str]:
+        """Build the row formatter for a table from TABLE_CONFIGS"""
         config = self.TABLE_CONFIGS.get(table)
         if not config:
             logger.warning(f"No config for table: {table}")
-            return ""
+            return lambda row: ""
         
-        try:
-            # Try to use template
-            text = config["template"].format(**{
-                k: str(row.get(k, "")).strip() 
-                for k in config["fields"]
-            })
-            
-            # If template produces mostly empty string, use fallback
-            if len(text.strip()) < 10 and config.get("fallback"):
-                text = config["fallback"].format(**{
-                    k: str(row.get(k, "")).strip() 
-                    for k in config["fields"]
-                })
-            
-            # Clean up the text
-            text = text.replace("\n\n\n", "\n\n")  # Remove excessive newlines
-            text = text.replace("None", "")  # Remove "None" strings
-            text = " ".join(text.split())  # Normalize whitespace
-            
-            return text.strip()
-            
-        except Exception as e:
-            logger.error(f"Error preparing text for {table}: {e}")
-            # Return fallback
-            if config.get("fallback"):
-                try:
-                    return config["fallback"].format(**{
-                        k: str(row.get(k, "")).strip() 
-                        for k in config["fields"]
-                    })
-                except:
-                    pass
-            return ""
+        render = _compile_template(config["template"])
+        render_fallback = _compile_template(config["fallback"]) if config.get("fallback") else None
+        
+        def build(row: Dict) -> str:
+            try:
+                # Try to use template
+                text = render(row)
+                
+                # If template produces mostly empty string, use fallback
+                if len(text.strip()) < 10 and render_fallback:
+                    text = render_fallback(row)
+                
+                return _clean_text(text)
+                
+            except Exception as e:
+                logger.error(f"Error preparing text for {table}: {e}")
+                # Return fallback
+                if render_fallback:
+                    try:
+                        return render_fallback(row)
+                    except:
+                        pass
+                return ""
+        
+        return build
     
     async def search_similar(
         self, 
@@ -205,27 +527,73 @@ class EmbeddingService:
             threshold: Similarity threshold (0-1)
             
         Returns:
-            List of matching rows with similarity scores
+            List of matching rows with similarity scores, most similar first
         """
+        if table not in self.TABLE_CONFIGS:
+            raise ValueError(f"Unknown table: {table}")
+        
         # Generate embedding for query
         query_embedding = await self.generate_embedding(query_text)
         
-        # Note: This would use the database service to perform vector search
-        # Implementation will be in the hybrid AI service
-        pass
+        # Nearest-neighbour search runs in Postgres (HNSW index, see
+        # migrations/004_match_records.sql)
+        result = await asyncio.to_thread(
+            get_database_service().client.rpc("match_records", {
+                "table_name": table,
+                "query_embedding": query_embedding,
+                "match_threshold": threshold,
+                "match_count": limit
+            }).execute
+        )
+        return [
+            {**row["record"], "similarity": row["similarity"]}
+            for row in result.data or []
+        ]
+    
+    def apply_content_filter(self, table: str, query):
+        """Restrict a query on `table` to rows that have text worth embedding"""
+        content_filter = self.TABLE_CONFIGS.get(table, {}).get("content_filter")
+        return query.or_(content_filter) if content_filter else query
     
     def get_enabled_tables(self) -> List[str]:
         """Get list of tables that have embedding enabled"""
-        return [
-            table 
-            for table, config in self.TABLE_CONFIGS.items() 
-            if config.get("enabled", False)
-        ]
+        return list(self._ENABLED_TABLES)
     
     def is_table_enabled(self, table: str) -> bool:
         """Check if embedding is enabled for a table"""
-        config = self.TABLE_CONFIGS.get(table, {})
-        return config.get("enabled", False)
+        return table in self._ENABLED_TABLE_SET
+    
+    @staticmethod
+    def top_k_cosine(
+        query,
+        matrix: np.ndarray,
+        k: int,
+        threshold: float = 0.0
+    ) -> List[Tuple[int, float]]:
+        """
+        Find the rows of an embedding matrix most similar to a query
+        
+        Args:
+            query: Query vector
+            matrix: (n, dims) float32 matrix of embeddings
+            k: Number of rows to return
+            threshold: Minimum cosine similarity
+            
+        Returns:
+            (row index, similarity) pairs, most similar first
+        """
+        if k <= 0 or not len(matrix):
+            return []
+        
+        query = np.asarray(query, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        # One matrix-vector product for every row; zero vectors score 0
+        sims = (matrix @ query) / np.where(norms == 0, 1, norms)
+        
+        # Partial sort: only the top k need ordering
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(sims) else np.arange(len(sims))
+        top = top[np.argsort(-sims[top])]
+        return [(int(i), float(sims[i])) for i in top if sims[i] >= threshold]
     
     async def estimate_cost(self, total_records: int) -> Dict[str, float]:
         """
@@ -248,10 +616,20 @@ class EmbeddingService:
             "total_records": total_records,
             "estimated_tokens": estimated_tokens,
             "estimated_cost_usd": round(estimated_cost, 2),
+            # Batch API is billed at 50% of the live endpoint
+            "estimated_batch_cost_usd": round(estimated_cost / 2, 2),
+            "use_batch_api": total_records >= self.OFFLINE_BATCH_THRESHOLD,
             "model": self.EMBEDDING_MODEL
         }
 
 
+# Singleton instance
+_embedding_service: Optional[EmbeddingService] = None
+
+
 def get_embedding_service() -> EmbeddingService:
-    """Get embedding service instance"""
-    return EmbeddingService()
\ No newline at end of file
+    """Get the shared embedding service (and its pooled OpenAI client)"""
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = EmbeddingService()
+    return _embedding_service
\ No newline at end of file
@@ -2,9 +2,13 @@
 MCP Chat Endpoint - n8n Webhook + MCP Fallback
 """
 
+import asyncio
+import hashlib
 import json
 import logging
+import time
 import httpx
+import orjson
 from typing import Dict, List, Optional
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
@@ -20,6 +24,37 @@ N8N_WEBHOOK_TEST_URL = "https://tlitatx.app.n8n.cloud/webhook-test/a10b5217-8945
 N8N_TIMEOUT = 120.0  # 2 minutes for AI agent
 
 
+# ==================== HTTP CLIENT ====================
+# Shared across requests so TLS sessions and keep-alive connections to n8n
+# are reused instead of re-established on every chat message
+_n8n_client: Optional[httpx.AsyncClient] = None
+
+
+def get_n8n_client() -> httpx.AsyncClient:
+    """Get the shared n8n HTTP client, creating it on first use"""
+    global _n8n_client
+    if _n8n_client is None:
+        _n8n_client = httpx.AsyncClient(
+            http2=True,
+            timeout=N8N_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    return _n8n_client
+
+
+@router.on_event("startup")
+async def open_n8n_client():
+    get_n8n_client()
+
+
+@router.on_event("shutdown")
+async def close_n8n_client():
+    global _n8n_client
+    if _n8n_client is not None:
+        await _n8n_client.aclose()
+        _n8n_client = None
+
+
 # ==================== MODELS ====================
 class ChatMessage(BaseModel):
     role: str
@@ -62,10 +97,10 @@ async def call_n8n_webhook(
     
     logger.info(f"🔗 Calling n8n: {url}")
     
-    async with httpx.AsyncClient(timeout=N8N_TIMEOUT) as client:
-        response = await client.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()
+    response = await get_n8n_client().post(url, json=payload)
+    response.raise_for_status()
+    # orjson parses the raw bytes directly, skipping the decode to str
+    return orjson.loads(response.content)
 
 
 # ==================== MCP FALLBACK ====================
@@ -103,6 +138,18 @@ async def call_mcp_fallback(
         raise
 
 
+# ==================== REQUEST COALESCING ====================
+# Identical chat requests already being answered, keyed by request hash.
+# Entries are removed as soon as the answer is ready, so this stays small.
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def _request_key(request: MCPChatRequest) -> str:
+    """Hash every field that affects the answer"""
+    body = orjson.dumps(request.model_dump(), option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
 # ==================== ENDPOINTS ====================
 @router.post("/chat", response_model=MCPChatResponse)
 async def mcp_chat(request: MCPChatRequest):
@@ -114,8 +161,27 @@ async def mcp_chat(request: MCPChatRequest):
     
     Set `use_test=true` to use n8n test webhook
     Set `force_mcp=true` to skip n8n and use MCP directly
+    
+    Duplicate requests arriving while one is in flight (client retries,
+    double submits) wait for that answer instead of calling n8n again.
     """
     
+    key = _request_key(request)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_answer_chat(request))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logger.info("♻️ Joining in-flight request for identical message")
+    
+    # Shield so one caller disconnecting doesn't cancel the others' answer
+    return await asyncio.shield(task)
+
+
+async def _answer_chat(request: MCPChatRequest) -> MCPChatResponse:
+    """Answer a chat request via n8n, falling back to MCP"""
+    
     source = "unknown"
     result = None
     error = None
@@ -170,23 +236,36 @@ async def mcp_chat(request: MCPChatRequest):
     raise HTTPException(status_code=500, detail="No response from n8n or MCP")
 
 
+# Last health probe result, reused for a few seconds to absorb probe bursts
+HEALTH_CACHE_SECONDS = 10.0
+_health_cache: Optional[tuple] = None  # (checked_at, result)
+
+
 @router.get("/health")
 async def mcp_health():
     """Check n8n webhook connectivity"""
+    global _health_cache
+    if _health_cache and time.monotonic() - _health_cache[0] < HEALTH_CACHE_SECONDS:
+        return _health_cache[1]
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Just check if n8n is reachable (HEAD request)
-            response = await client.get(N8N_WEBHOOK_TEST_URL.replace("/webhook-test/", "/"))
-            return {
-                "status": "ok",
-                "n8n_reachable": response.status_code < 500,
-                "webhook_url": N8N_WEBHOOK_URL
-            }
+        # Just check if n8n is reachable (HEAD request, no body transferred)
+        response = await get_n8n_client().head(
+            N8N_WEBHOOK_URL.rsplit("/webhook/", 1)[0],
+            timeout=5.0
+        )
+        result = {
+            "status": "ok",
+            "n8n_reachable": response.status_code < 500,
+            "webhook_url": N8N_WEBHOOK_URL
+        }
     except Exception as e:
-        return {
+        result = {
             "status": "degraded",
             "n8n_reachable": False,
             "error": str(e),
             "fallback": "MCP available"
-        }
\ No newline at end of file
+        }
+    
+    _health_cache = (time.monotonic(), result)
+    return result
@@ -0,0 +1,256 @@
+"""
+Shared helpers for the standalone Autotask -> Supabase sync scripts
+(fetchandrun.py, resources.py)
+"""
+import httpx
+import asyncio
+import orjson
+import random
+from datetime import datetime
+from postgrest.types import ReturnMethod
+
+
+def autotask_client() -> httpx.AsyncClient:
+    """HTTP/2 client for Autotask: pages are multiplexed over one kept-alive connection"""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=32, keepalive_expiry=60.0)
+    )
+
+
+# Throttling and gateway errors worth retrying the same page for
+RETRIABLE_STATUS_CODES = {429, 502, 503, 504}
+
+
+async def post_with_retry(client: httpx.AsyncClient, url: str, payload: dict, headers: dict, max_retries: int = 5) -> httpx.Response:
+    """POST an Autotask query, retrying transient failures with jittered backoff"""
+    for attempt in range(1, max_retries + 1):
+        try:
+            response = await client.post(url, content=orjson.dumps(payload), headers=headers)
+            if response.status_code not in RETRIABLE_STATUS_CODES or attempt == max_retries:
+                response.raise_for_status()
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            reason = f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            if attempt == max_retries:
+                raise
+            retry_after = ""
+            reason = type(e).__name__
+        
+        # Honor the server's hint on 429, otherwise back off exponentially
+        delay = float(retry_after) if retry_after.isdigit() else random.uniform(0, min(8, 0.5 * 2 ** attempt))
+        print(f"  ⚠ {reason} from Autotask, retrying in {delay:.1f}s ({attempt}/{max_retries})")
+        await asyncio.sleep(delay)
+
+
+# Database column -> (Autotask field, default when missing)
+RESOURCE_FIELDS = {
+    "id": ("id", None),
+    "accounting_reference_id": ("accountingReferenceID", ""),
+    "date_format": ("dateFormat", None),
+    "default_service_desk_role_id": ("defaultServiceDeskRoleID", None),
+    "email": ("email", ""),
+    "email2": ("email2", ""),
+    "email3": ("email3", ""),
+    "email_type_code": ("emailTypeCode", None),
+    "email_type_code2": ("emailTypeCode2", None),
+    "email_type_code3": ("emailTypeCode3", None),
+    "first_name": ("firstName", ""),
+    "gender": ("gender", None),
+    "greeting": ("greeting", None),
+    "hire_date": ("hireDate", None),
+    "home_phone": ("homePhone", ""),
+    "initials": ("initials", ""),
+    "internal_cost": ("internalCost", None),
+    "is_active": ("isActive", True),
+    "last_name": ("lastName", ""),
+    "license_type": ("licenseType", None),
+    "location_id": ("locationID", None),
+    "middle_name": ("middleName", ""),
+    "mobile_phone": ("mobilePhone", ""),
+    "number_format": ("numberFormat", None),
+    "office_extension": ("officeExtension", ""),
+    "office_phone": ("officePhone", ""),
+    "payroll_identifier": ("payrollIdentifier", ""),
+    "payroll_type": ("payrollType", None),
+    "resource_type": ("resourceType", None),
+    "suffix": ("suffix", None),
+    "survey_resource_rating": ("surveyResourceRating", None),
+    "time_format": ("timeFormat", None),
+    "title": ("title", ""),
+    "travel_availability_pct": ("travelAvailabilityPct", None),
+    "user_name": ("userName", ""),
+    "user_type": ("userType", None),
+}
+
+
+# Database column -> (Autotask field, default when missing)
+CONTACT_FIELDS = {
+    "id": ("id", None),
+    "additional_address_information": ("additionalAddressInformation", ""),
+    "address_line": ("addressLine", ""),
+    "address_line1": ("addressLine1", ""),
+    "alternate_phone": ("alternatePhone", ""),
+    "api_vendor_id": ("apiVendorID", None),
+    "bulk_email_opt_out_time": ("bulkEmailOptOutTime", None),
+    "city": ("city", ""),
+    "company_id": ("companyID", None),
+    "company_location_id": ("companyLocationID", None),
+    "country_id": ("countryID", None),
+    "create_date": ("createDate", None),
+    "email_address": ("emailAddress", ""),
+    "email_address2": ("emailAddress2", None),
+    "email_address3": ("emailAddress3", None),
+    "extension": ("extension", ""),
+    "external_id": ("externalID", ""),
+    "facebook_url": ("facebookUrl", ""),
+    "fax_number": ("faxNumber", ""),
+    "first_name": ("firstName", ""),
+    "impersonator_creator_resource_id": ("impersonatorCreatorResourceID", None),
+    "is_active": ("isActive", 1),
+    "is_opted_out_from_bulk_email": ("isOptedOutFromBulkEmail", False),
+    "last_activity_date": ("lastActivityDate", None),
+    "last_modified_date": ("lastModifiedDate", None),
+    "last_name": ("lastName", ""),
+    "linked_in_url": ("linkedInUrl", ""),
+    "middle_initial": ("middleInitial", None),
+    "mobile_phone": ("mobilePhone", ""),
+    "name_prefix": ("namePrefix", None),
+    "name_suffix": ("nameSuffix", None),
+    "note": ("note", ""),
+    "receives_email_notifications": ("receivesEmailNotifications", False),
+    "phone": ("phone", ""),
+    "primary_contact": ("primaryContact", False),
+    "billing_contact": ("billingContact", False),
+    "room_number": ("roomNumber", ""),
+    "solicitation_opt_out": ("solicitationOptOut", False),
+    "solicitation_opt_out_time": ("solicitationOptOutTime", None),
+    "state": ("state", ""),
+    "survey_opt_out": ("surveyOptOut", False),
+    "title": ("title", ""),
+    "twitter_url": ("twitterUrl", ""),
+    "zip_code": ("zipCode", ""),
+}
+
+def convert_records(records: list, fields: dict, now_iso: str) -> list:
+    """Map a batch of Autotask records to database rows via a column -> (field, default) table"""
+    items = tuple(fields.items())
+    rows = []
+    for record in records:
+        row = {db_key: record.get(api_key, default) for db_key, (api_key, default) in items}
+        row["updated_at"] = now_iso
+        rows.append(row)
+    return rows
+
+
+def dedupe_by_id(records: list) -> list:
+    """Drop repeated records, keeping the last copy of each id"""
+    return list({record["id"]: record for record in records}.values())
+
+
+async def iter_pages(zone_url: str, headers: dict, entity: str, extra_filters=(), on_page=None):
+    """
+    Yield pages of an Autotask entity (e.g. "Resources", "Contacts") as they are fetched.
+    Pages are walked with an id > last_id cursor, 500 records at a time.
+    extra_filters are added to the cursor filter; on_page, if given, is
+    called with each page before it is yielded (e.g. to report counts).
+    """
+    label = entity.lower()
+    fetched = 0
+    last_id = 0
+    url = f"{zone_url}/atservicesrest/v1.0/{entity}/query"
+    
+    async with autotask_client() as client:
+        while True:
+            payload = {
+                "MaxRecords": 500,
+                "Filter": [{"field": "id", "op": "gt", "value": last_id}, *extra_filters]
+            }
+            
+            try:
+                response = await post_with_retry(client, url, payload, headers)
+                data = orjson.loads(response.content)
+                records = data.get("items", [])
+            except Exception as e:
+                print(f"  ✗ Error fetching {label}: {str(e)}")
+                raise
+            
+            if not records:
+                break
+            
+            fetched += len(records)
+            last_id = records[-1]["id"]
+            print(f"  ✓ Fetched {len(records)} {label} (Total: {fetched})")
+            if on_page:
+                on_page(records)
+            
+            yield records
+            
+            if len(records) < 500:
+                break
+
+
+def store_batch(supabase, batch, batch_no, table, converter):
+    """Upsert one batch into table via converter, returning how many were stored"""
+    # Postgres rejects an upsert that touches the same row twice
+    batch = dedupe_by_id(batch)
+    try:
+        # Convert to database format
+        now_iso = datetime.now().isoformat()
+        db_batch = converter(batch, now_iso)
+        
+        # Upsert (rows aren't echoed back)
+        supabase.table(table).upsert(
+            db_batch, on_conflict="id", returning=ReturnMethod.minimal
+        ).execute()
+        print(f"  ✓ Stored batch {batch_no}: {len(batch)} {table}")
+        return len(batch)
+        
+    except Exception as e:
+        print(f"  ✗ Error storing {table} batch {batch_no}: {str(e)}")
+        return 0
+
+
+async def fetch_and_store(pages, supabase, table, converter, batch_size: int = 1000):
+    """
+    Store fetched pages into table (converted with converter) in a worker
+    thread while the next pages are fetched. Pages are gathered into upserts
+    of batch_size rows (two 500-record Autotask pages by default) and dropped
+    once stored, so memory stays at a few pages whatever the tenant size.
+    
+    Returns (fetched_count, synced_count)
+    """
+    queue = asyncio.Queue(maxsize=4)
+    totals = {"fetched": 0, "synced": 0}
+    
+    async def produce():
+        try:
+            async for page in pages:
+                totals["fetched"] += len(page)
+                await queue.put(page)
+        finally:
+            # End-of-stream marker, also sent if the fetch fails
+            await queue.put(None)
+    
+    async def consume():
+        batch_no = 0
+        pending = []
+        while True:
+            page = await queue.get()
+            if page is not None:
+                pending.extend(page)
+            # Upsert full batches, and whatever is left once the stream ends
+            while len(pending) >= batch_size or (page is None and pending):
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                batch_no += 1
+                # supabase-py is synchronous; keep it off the event loop
+                totals["synced"] += await asyncio.to_thread(
+                    store_batch, supabase, batch, batch_no, table, converter
+                )
+            if page is None:
+                break
+    
+    await asyncio.gather(produce(), consume())
+    return totals["fetched"], totals["synced"]
@@ -0,0 +1,17 @@
+-- Row counts for every synced table in a single round trip.
+-- Used by DatabaseService.get_database_stats().
+
+CREATE OR REPLACE FUNCTION public.db_counts()
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT json_build_object(
+    'tickets',      (SELECT count(*) FROM public.tickets),
+    'notes',        (SELECT count(*) FROM public.ticket_notes),
+    'time_entries', (SELECT count(*) FROM public.time_entries),
+    'companies',    (SELECT count(*) FROM public.companies),
+    'resources',    (SELECT count(*) FROM public.resources),
+    'contacts',     (SELECT count(*) FROM public.contacts)
+  );
+$$;
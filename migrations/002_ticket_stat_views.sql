@@ -0,0 +1,12 @@
+-- Ticket counts aggregated in Postgres instead of shipping every row.
+-- Used by DatabaseService.get_ticket_stats_by_status/_by_priority().
+
+CREATE OR REPLACE VIEW public.ticket_status_counts AS
+SELECT status, count(*)::integer AS count
+FROM public.tickets
+GROUP BY status;
+
+CREATE OR REPLACE VIEW public.ticket_priority_counts AS
+SELECT priority, count(*)::integer AS count
+FROM public.tickets
+GROUP BY priority;
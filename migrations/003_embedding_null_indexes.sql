@@ -0,0 +1,23 @@
+-- Partial indexes covering rows that still need an embedding, so the
+-- embedding sync's "embedding IS NULL ORDER BY id" batch fetch is an index
+-- range scan instead of a sequential scan.
+-- CONCURRENTLY cannot run inside a transaction: run these statements one
+-- at a time (e.g. from the SQL editor), not wrapped in BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_embedding_null
+  ON public.tickets (id) WHERE embedding IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ticket_notes_embedding_null
+  ON public.ticket_notes (id) WHERE embedding IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resources_embedding_null
+  ON public.resources (id) WHERE embedding IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contacts_embedding_null
+  ON public.contacts (id) WHERE embedding IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_companies_embedding_null
+  ON public.companies (id) WHERE embedding IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_time_entries_embedding_null
+  ON public.time_entries (id) WHERE embedding IS NULL;
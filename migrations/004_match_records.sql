@@ -0,0 +1,58 @@
+-- Vector similarity search over any embedded table.
+-- Used by EmbeddingService.search_similar().
+--
+-- The inner query orders by cosine distance with a LIMIT so the planner can
+-- use the HNSW indexes below; the threshold is applied to that shortlist.
+
+CREATE OR REPLACE FUNCTION public.match_records(
+  table_name text,
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int
+)
+RETURNS TABLE (record jsonb, similarity float)
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+  IF table_name NOT IN ('tickets', 'ticket_notes', 'resources', 'contacts', 'companies', 'time_entries') THEN
+    RAISE EXCEPTION 'match_records: unsupported table %', table_name;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'SELECT m.record, m.similarity FROM (
+       SELECT to_jsonb(t) - ''embedding'' AS record,
+              (1 - (t.embedding <=> $1))::float AS similarity
+         FROM public.%I t
+        WHERE t.embedding IS NOT NULL
+        ORDER BY t.embedding <=> $1
+        LIMIT $2
+     ) m
+     WHERE m.similarity > $3',
+    table_name
+  )
+  USING query_embedding, match_count, match_threshold;
+END;
+$$;
+
+-- HNSW indexes for approximate nearest-neighbour search by cosine distance.
+-- CONCURRENTLY cannot run inside a transaction: run these statements one
+-- at a time (e.g. from the SQL editor), not wrapped in BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_embedding_hnsw
+  ON public.tickets USING hnsw (embedding vector_cosine_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ticket_notes_embedding_hnsw
+  ON public.ticket_notes USING hnsw (embedding vector_cosine_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resources_embedding_hnsw
+  ON public.resources USING hnsw (embedding vector_cosine_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contacts_embedding_hnsw
+  ON public.contacts USING hnsw (embedding vector_cosine_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_companies_embedding_hnsw
+  ON public.companies USING hnsw (embedding vector_cosine_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_time_entries_embedding_hnsw
+  ON public.time_entries USING hnsw (embedding vector_cosine_ops);
@@ -0,0 +1,35 @@
+-- Set-based ticket name refresh for the resource/contact sync scripts
+-- (resources.py, fetchandrun.py): one call per stored batch instead of one
+-- UPDATE request per resource or contact.
+-- pairs: JSON array of {"id": <resource/contact id>, "name": <display name>}.
+-- Returns the number of tickets updated.
+
+CREATE OR REPLACE FUNCTION public.bulk_update_ticket_resource_names(pairs jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE public.tickets t
+       SET assigned_resource_name = p.name,
+           updated_at = now()
+      FROM jsonb_to_recordset(pairs) AS p(id integer, name text)
+     WHERE t.assigned_resource_id = p.id
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$;
+
+CREATE OR REPLACE FUNCTION public.bulk_update_ticket_contact_names(pairs jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE public.tickets t
+       SET contact_name = p.name,
+           updated_at = now()
+      FROM jsonb_to_recordset(pairs) AS p(id integer, name text)
+     WHERE t.contact_id = p.id
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$;
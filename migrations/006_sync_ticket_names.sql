@@ -0,0 +1,49 @@
+-- Refresh the denormalized names on tickets straight from the resources and
+-- contacts tables, in one statement each. Called once by the sync scripts
+-- after all resources/contacts are stored, replacing the per-batch
+-- bulk_update_ticket_*_names RPCs from 005.
+-- Only tickets whose name actually changes are written (so updated_at is
+-- not bumped on no-op resyncs). Returns the number of tickets updated.
+
+CREATE OR REPLACE FUNCTION public.sync_ticket_resource_names()
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE public.tickets t
+       SET assigned_resource_name = r.name,
+           updated_at = now()
+      FROM (
+        SELECT id, trim(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) AS name
+          FROM public.resources
+      ) r
+     WHERE t.assigned_resource_id = r.id
+       AND r.name <> ''
+       AND t.assigned_resource_name IS DISTINCT FROM r.name
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$;
+
+CREATE OR REPLACE FUNCTION public.sync_ticket_contact_names()
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH updated AS (
+    UPDATE public.tickets t
+       SET contact_name = c.name,
+           updated_at = now()
+      FROM (
+        SELECT id, trim(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) AS name
+          FROM public.contacts
+      ) c
+     WHERE t.contact_id = c.id
+       AND c.name <> ''
+       AND t.contact_name IS DISTINCT FROM c.name
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$;
+
+DROP FUNCTION IF EXISTS public.bulk_update_ticket_resource_names(jsonb);
+DROP FUNCTION IF EXISTS public.bulk_update_ticket_contact_names(jsonb);
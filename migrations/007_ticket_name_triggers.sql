@@ -0,0 +1,68 @@
+-- Keep tickets.assigned_resource_name / contact_name in step with the
+-- resources and contacts tables inside the database, so no sync code has to
+-- maintain them:
+--   * renaming (or first storing) a resource/contact updates its tickets
+--   * inserting a ticket, or reassigning it, fills the names from the lookups
+-- sync_ticket_*_names() from 006 remain for a one-off backfill of existing rows.
+
+CREATE OR REPLACE FUNCTION public.propagate_resource_name()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE public.tickets
+     SET assigned_resource_name = trim(coalesce(NEW.first_name, '') || ' ' || coalesce(NEW.last_name, '')),
+         updated_at = now()
+   WHERE assigned_resource_id = NEW.id;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS resources_propagate_name ON public.resources;
+CREATE TRIGGER resources_propagate_name
+  AFTER INSERT OR UPDATE OF first_name, last_name ON public.resources
+  FOR EACH ROW EXECUTE FUNCTION public.propagate_resource_name();
+
+CREATE OR REPLACE FUNCTION public.propagate_contact_name()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE public.tickets
+     SET contact_name = trim(coalesce(NEW.first_name, '') || ' ' || coalesce(NEW.last_name, '')),
+         updated_at = now()
+   WHERE contact_id = NEW.id;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS contacts_propagate_name ON public.contacts;
+CREATE TRIGGER contacts_propagate_name
+  AFTER INSERT OR UPDATE OF first_name, last_name ON public.contacts
+  FOR EACH ROW EXECUTE FUNCTION public.propagate_contact_name();
+
+CREATE OR REPLACE FUNCTION public.fill_ticket_names()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.assigned_resource_id IS NOT NULL THEN
+    SELECT trim(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))
+      INTO NEW.assigned_resource_name
+      FROM public.resources
+     WHERE id = NEW.assigned_resource_id;
+  END IF;
+  IF NEW.contact_id IS NOT NULL THEN
+    SELECT trim(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))
+      INTO NEW.contact_name
+      FROM public.contacts
+     WHERE id = NEW.contact_id;
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS tickets_fill_names ON public.tickets;
+CREATE TRIGGER tickets_fill_names
+  BEFORE INSERT OR UPDATE OF assigned_resource_id, contact_id ON public.tickets
+  FOR EACH ROW EXECUTE FUNCTION public.fill_ticket_names();
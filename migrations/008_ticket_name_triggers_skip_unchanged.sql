@@ -0,0 +1,77 @@
+-- Refine the 007 name triggers so resyncs that change nothing write nothing.
+-- A full resource/contact resync re-upserts every row with the same names;
+-- before this, each one rewrote (and bumped updated_at on) all its tickets.
+--   * resource/contact updates only fire when first_name/last_name change
+--   * tickets are only written when their stored name differs
+--   * ticket updates only look names up when the resource/contact id changes
+
+CREATE OR REPLACE FUNCTION public.propagate_resource_name()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  new_name text := trim(coalesce(NEW.first_name, '') || ' ' || coalesce(NEW.last_name, ''));
+BEGIN
+  UPDATE public.tickets
+     SET assigned_resource_name = new_name,
+         updated_at = now()
+   WHERE assigned_resource_id = NEW.id
+     AND assigned_resource_name IS DISTINCT FROM new_name;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS resources_propagate_name ON public.resources;
+CREATE TRIGGER resources_propagate_name
+  AFTER INSERT ON public.resources
+  FOR EACH ROW EXECUTE FUNCTION public.propagate_resource_name();
+
+DROP TRIGGER IF EXISTS resources_propagate_name_change ON public.resources;
+CREATE TRIGGER resources_propagate_name_change
+  AFTER UPDATE OF first_name, last_name ON public.resources
+  FOR EACH ROW
+  WHEN (OLD.first_name IS DISTINCT FROM NEW.first_name
+        OR OLD.last_name IS DISTINCT FROM NEW.last_name)
+  EXECUTE FUNCTION public.propagate_resource_name();
+
+CREATE OR REPLACE FUNCTION public.propagate_contact_name()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  new_name text := trim(coalesce(NEW.first_name, '') || ' ' || coalesce(NEW.last_name, ''));
+BEGIN
+  UPDATE public.tickets
+     SET contact_name = new_name,
+         updated_at = now()
+   WHERE contact_id = NEW.id
+     AND contact_name IS DISTINCT FROM new_name;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS contacts_propagate_name ON public.contacts;
+CREATE TRIGGER contacts_propagate_name
+  AFTER INSERT ON public.contacts
+  FOR EACH ROW EXECUTE FUNCTION public.propagate_contact_name();
+
+DROP TRIGGER IF EXISTS contacts_propagate_name_change ON public.contacts;
+CREATE TRIGGER contacts_propagate_name_change
+  AFTER UPDATE OF first_name, last_name ON public.contacts
+  FOR EACH ROW
+  WHEN (OLD.first_name IS DISTINCT FROM NEW.first_name
+        OR OLD.last_name IS DISTINCT FROM NEW.last_name)
+  EXECUTE FUNCTION public.propagate_contact_name();
+
+DROP TRIGGER IF EXISTS tickets_fill_names ON public.tickets;
+CREATE TRIGGER tickets_fill_names
+  BEFORE INSERT ON public.tickets
+  FOR EACH ROW EXECUTE FUNCTION public.fill_ticket_names();
+
+DROP TRIGGER IF EXISTS tickets_fill_names_change ON public.tickets;
+CREATE TRIGGER tickets_fill_names_change
+  BEFORE UPDATE OF assigned_resource_id, contact_id ON public.tickets
+  FOR EACH ROW
+  WHEN (OLD.assigned_resource_id IS DISTINCT FROM NEW.assigned_resource_id
+        OR OLD.contact_id IS DISTINCT FROM NEW.contact_id)
+  EXECUTE FUNCTION public.fill_ticket_names();
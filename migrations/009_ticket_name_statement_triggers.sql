@@ -0,0 +1,111 @@
+-- Replace the per-row resource/contact name triggers from 007/008 with
+-- statement-level ones: a 1000-row upsert from resources.py / fetchandrun.py
+-- now runs one joined UPDATE of tickets instead of 1000 separate ones.
+--   * tickets are only written when their stored name differs
+--   * empty names are skipped rather than written as ''
+--   * ticket inserts/reassignments keep the existing name when the lookup
+--     is missing or empty
+-- Transition tables cannot be combined with multiple events or column lists,
+-- hence separate INSERT and UPDATE triggers sharing one function.
+-- The two indexes at the end use CONCURRENTLY and cannot run inside a
+-- transaction: run them one at a time, not wrapped in BEGIN/COMMIT.
+
+DROP TRIGGER IF EXISTS resources_propagate_name ON public.resources;
+DROP TRIGGER IF EXISTS resources_propagate_name_change ON public.resources;
+DROP TRIGGER IF EXISTS contacts_propagate_name ON public.contacts;
+DROP TRIGGER IF EXISTS contacts_propagate_name_change ON public.contacts;
+
+CREATE OR REPLACE FUNCTION public.propagate_resource_name()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE public.tickets t
+     SET assigned_resource_name = n.name,
+         updated_at = now()
+    FROM (
+      SELECT id, trim(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) AS name
+        FROM new_rows
+    ) n
+   WHERE t.assigned_resource_id = n.id
+     AND n.name <> ''
+     AND t.assigned_resource_name IS DISTINCT FROM n.name;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER resources_propagate_name
+  AFTER INSERT ON public.resources
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.propagate_resource_name();
+
+CREATE TRIGGER resources_propagate_name_change
+  AFTER UPDATE ON public.resources
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.propagate_resource_name();
+
+CREATE OR REPLACE FUNCTION public.propagate_contact_name()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE public.tickets t
+     SET contact_name = n.name,
+         updated_at = now()
+    FROM (
+      SELECT id, trim(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) AS name
+        FROM new_rows
+    ) n
+   WHERE t.contact_id = n.id
+     AND n.name <> ''
+     AND t.contact_name IS DISTINCT FROM n.name;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER contacts_propagate_name
+  AFTER INSERT ON public.contacts
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.propagate_contact_name();
+
+CREATE TRIGGER contacts_propagate_name_change
+  AFTER UPDATE ON public.contacts
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.propagate_contact_name();
+
+-- Ticket-side triggers (tickets_fill_names / tickets_fill_names_change from
+-- 008) stay row-level: each lookup is a primary-key read.
+CREATE OR REPLACE FUNCTION public.fill_ticket_names()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  looked_up text;
+BEGIN
+  IF NEW.assigned_resource_id IS NOT NULL THEN
+    SELECT nullif(trim(coalesce(first_name, '') || ' ' || coalesce(last_name, '')), '')
+      INTO looked_up
+      FROM public.resources
+     WHERE id = NEW.assigned_resource_id;
+    IF looked_up IS NOT NULL THEN
+      NEW.assigned_resource_name := looked_up;
+    END IF;
+  END IF;
+  IF NEW.contact_id IS NOT NULL THEN
+    SELECT nullif(trim(coalesce(first_name, '') || ' ' || coalesce(last_name, '')), '')
+      INTO looked_up
+      FROM public.contacts
+     WHERE id = NEW.contact_id;
+    IF looked_up IS NOT NULL THEN
+      NEW.contact_name := looked_up;
+    END IF;
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_assigned_resource_id
+  ON public.tickets (assigned_resource_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_contact_id
+  ON public.tickets (contact_id);
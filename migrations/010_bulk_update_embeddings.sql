@@ -0,0 +1,34 @@
+-- Set-based embedding write-back for the embedding sync
+-- (app/services/embed_all_records.py): one UPDATE per batch that touches only
+-- the embedding columns, so rows synced from Autotask after the batch was
+-- fetched are not overwritten with stale values.
+-- rows: JSON array of {"id", "embedding", "embedding_text", "last_embedded_at"}.
+-- Returns the number of rows updated.
+
+CREATE OR REPLACE FUNCTION public.bulk_update_embeddings(table_name text, rows jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  updated integer;
+BEGIN
+  IF table_name NOT IN ('tickets', 'ticket_notes', 'resources', 'contacts', 'companies', 'time_entries') THEN
+    RAISE EXCEPTION 'bulk_update_embeddings: unsupported table %', table_name;
+  END IF;
+
+  EXECUTE format(
+    'UPDATE public.%I t
+        SET embedding = r.embedding::vector,
+            embedding_text = r.embedding_text,
+            last_embedded_at = r.last_embedded_at
+       FROM jsonb_to_recordset($1)
+            AS r(id bigint, embedding text, embedding_text text, last_embedded_at timestamptz)
+      WHERE t.id = r.id',
+    table_name
+  )
+  USING rows;
+
+  GET DIAGNOSTICS updated = ROW_COUNT;
+  RETURN updated;
+END;
+$$;